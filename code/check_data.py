@@ -7,14 +7,19 @@ With QGIS : 34201
 
 from typing import Any, Optional
 
+from qgis.core import Qgis
+from qgis.core import QgsApplication
+from qgis.core import QgsFeature
 from qgis.core import QgsProcessing
 from qgis.core import QgsProcessingAlgorithm
 from qgis.core import QgsProcessingContext
+from qgis.core import QgsProcessingException
 from qgis.core import QgsProcessingFeedback, QgsProcessingMultiStepFeedback
 from qgis.core import QgsProcessingParameterString
 from qgis.core import QgsProcessingParameterVectorLayer
 from qgis.core import QgsCoordinateReferenceSystem
-from qgis import processing
+from qgis.core import QgsMemoryProviderUtils
+from qgis.core import QgsWkbTypes
 
 
 class Modell(QgsProcessingAlgorithm):
@@ -23,10 +28,31 @@ class Modell(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterString('layername', 'Layername', multiLine=False, defaultValue=None))
         self.addParameter(QgsProcessingParameterVectorLayer('rohdaten', 'Rohdaten', types=[QgsProcessing.TypeVectorPolygon], defaultValue=None))
 
+        # Resolve the child algorithms once per execution, instead of looking them up by name for every call.
+        # Algorithms of a provider which is not loaded resolve to None and are reported in runChildAlgorithm
+        registry = QgsApplication.processingRegistry()
+        self.algorithms = {
+            alg_id: registry.algorithmById(alg_id)
+            for alg_id in (
+                'native:createspatialindex',
+                'native:loadlayer',
+                'native:reprojectlayer',
+            )
+        }
+
+    def runChildAlgorithm(self, alg_id: str, alg_params: dict[str, Any], context: QgsProcessingContext, feedback: QgsProcessingFeedback) -> dict[str, Any]:
+        algorithm = self.algorithms.get(alg_id)
+        if algorithm is None:
+            raise QgsProcessingException(f'Algorithmus {alg_id} nicht gefunden')
+        results, ok = algorithm.run(alg_params, context, feedback)
+        if not ok:
+            raise QgsProcessingException(f'Algorithmus {alg_id} fehlgeschlagen')
+        return results
+
     def processAlgorithm(self, parameters: dict[str, Any], context: QgsProcessingContext, model_feedback: QgsProcessingFeedback) -> dict[str, Any]:
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
-        feedback = QgsProcessingMultiStepFeedback(7, model_feedback)
+        feedback = QgsProcessingMultiStepFeedback(5, model_feedback)
         results = {}
         outputs = {}
 
@@ -34,69 +60,84 @@ class Modell(QgsProcessingAlgorithm):
         alg_params = {
             'INPUT': parameters['rohdaten']
         }
-        outputs['RumlichenIndexErzeugen'] = processing.run('native:createspatialindex', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['RumlichenIndexErzeugen'] = self.runChildAlgorithm('native:createspatialindex', alg_params, context, feedback)
 
         feedback.setCurrentStep(1)
         if feedback.isCanceled():
             return {}
 
-        # Geometrien reparieren
-        alg_params = {
-            'INPUT': outputs['RumlichenIndexErzeugen']['OUTPUT'],
-            'METHOD': 1,  # Struktur
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['GeometrienReparieren'] = processing.run('native:fixgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        # Geometrien reparieren (Struktur), Rechte-Hand-Regel erzwingen und Geometrietyp
+        # in Einzelpolygone umwandeln - in einem Durchlauf je Objekt, statt über
+        # native:fixgeometries, native:forcerhr und qgis:convertgeometrytype
+        rohdaten = self.parameterAsVectorLayer(parameters, 'rohdaten', context)
+        # Einzelpolygone mit den Z- und M-Werten der Rohdaten
+        geometrietyp = QgsWkbTypes.Type.Polygon
+        if QgsWkbTypes.hasZ(rohdaten.wkbType()):
+            geometrietyp = QgsWkbTypes.addZ(geometrietyp)
+        if QgsWkbTypes.hasM(rohdaten.wkbType()):
+            geometrietyp = QgsWkbTypes.addM(geometrietyp)
+        polygone = QgsMemoryProviderUtils.createMemoryLayer('polygone', rohdaten.fields(), geometrietyp, rohdaten.crs())
+        features = []
+        anzahl = rohdaten.featureCount()
+        for current, feature in enumerate(rohdaten.getFeatures()):
+            if feedback.isCanceled():
+                return {}
+            if anzahl > 0:
+                feedback.setProgress(current * 100 // anzahl)
+            # Objekte ohne Geometrie werden wie von native:fixgeometries unverändert übernommen
+            if not feature.hasGeometry():
+                features.append(QgsFeature(feature))
+                continue
+            geometry = feature.geometry().makeValid(Qgis.MakeValidMethod.Structure)
+            if geometry.isNull():
+                feedback.reportError(f'Geometrie von Objekt {feature.id()} konnte nicht repariert werden: {geometry.lastError()}')
+                continue
+            geometry.convertGeometryCollectionToSubclass(QgsWkbTypes.GeometryType.PolygonGeometry)
+            geometry = geometry.forceRHR()
+            for part in geometry.asGeometryCollection():
+                # die Reparatur kann Linien oder Punkte liefern, die keine Polygone sind
+                if part.type() != QgsWkbTypes.GeometryType.PolygonGeometry:
+                    feedback.pushWarning(f'Nicht-Polygon-Teil von Objekt {feature.id()} nach der Reparatur verworfen')
+                    continue
+                polygon = QgsFeature(feature)
+                polygon.setGeometry(part)
+                features.append(polygon)
+        ok, _ = polygone.dataProvider().addFeatures(features)
+        if not ok:
+            raise QgsProcessingException(f'Objekte konnten nicht in den Layer polygone geschrieben werden: {polygone.dataProvider().lastError()}')
+        context.temporaryLayerStore().addMapLayer(polygone)
+        outputs['GeometrietypUmwandeln'] = {'OUTPUT': polygone.id()}
 
         feedback.setCurrentStep(2)
         if feedback.isCanceled():
             return {}
 
-        # Rechter-Hand-Regel erzwingen
-        alg_params = {
-            'INPUT': outputs['GeometrienReparieren']['OUTPUT'],
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['RechterhandregelErzwingen'] = processing.run('native:forcerhr', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(3)
-        if feedback.isCanceled():
-            return {}
-
         # Layer in Projekt laden
         alg_params = {
-            'INPUT': outputs['RechterhandregelErzwingen']['OUTPUT'],
+            'INPUT': outputs['GeometrietypUmwandeln']['OUTPUT'],
             'NAME': 'test'
         }
-        outputs['LayerInProjektLaden'] = processing.run('native:loadlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['LayerInProjektLaden_raw'] = self.runChildAlgorithm('native:loadlayer', alg_params, context, feedback)
 
-        feedback.setCurrentStep(4)
-        if feedback.isCanceled():
-            return {}
-
-        # Geometrietyp umwandeln
-        alg_params = {
-            'INPUT': outputs['RechterhandregelErzwingen']['OUTPUT'],
-            'TYPE': 4,  # Polygons
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['GeometrietypUmwandeln'] = processing.run('qgis:convertgeometrytype', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(5)
+        feedback.setCurrentStep(3)
         if feedback.isCanceled():
             return {}
 
-        # Layer reprojizieren
-        alg_params = {
-            'CONVERT_CURVED_GEOMETRIES': True,
-            'INPUT': outputs['GeometrietypUmwandeln']['OUTPUT'],
-            'OPERATION': None,
-            'TARGET_CRS': QgsCoordinateReferenceSystem('EPSG:25832'),
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['LayerReprojizieren'] = processing.run('native:reprojectlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        # Layer reprojizieren (nur falls erforderlich)
+        target_crs = QgsCoordinateReferenceSystem('EPSG:25832')
+        if rohdaten.crs() != target_crs:
+            alg_params = {
+                'CONVERT_CURVED_GEOMETRIES': True,
+                'INPUT': outputs['GeometrietypUmwandeln']['OUTPUT'],
+                'OPERATION': None,
+                'TARGET_CRS': target_crs,
+                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+            }
+            outputs['LayerReprojizieren'] = self.runChildAlgorithm('native:reprojectlayer', alg_params, context, feedback)
+        else:
+            outputs['LayerReprojizieren'] = outputs['GeometrietypUmwandeln']
 
-        feedback.setCurrentStep(6)
+        feedback.setCurrentStep(4)
         if feedback.isCanceled():
             return {}
 
@@ -105,7 +146,7 @@ class Modell(QgsProcessingAlgorithm):
             'INPUT': outputs['LayerReprojizieren']['OUTPUT'],
             'NAME': parameters['layername']
         }
-        outputs['LayerInProjektLaden'] = processing.run('native:loadlayer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['LayerInProjektLaden_final'] = self.runChildAlgorithm('native:loadlayer', alg_params, context, feedback)
         return results
 
     def name(self) -> str:
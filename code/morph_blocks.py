@@ -9,20 +9,39 @@
 ***************************************************************************
 """
 
-from typing import Any, Optional
-
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Any, Iterable, Iterator, Optional
+
+from qgis.PyQt.QtCore import QVariant
 from qgis.core import (
+    Qgis,
+    QgsFeature,
+    QgsFeatureRequest,
     QgsFeatureSink,
+    QgsFeatureSource,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
     QgsProcessing,
     QgsProcessingAlgorithm,
     QgsProcessingContext,
     QgsProcessingException,
     QgsProcessingFeedback,
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingParameterBoolean,
     QgsProcessingParameterFeatureSink,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterNumber,
     QgsProcessingParameterExtent,
-    QgsCoordinateReferenceSystem,
+    QgsProcessingUtils,
+    QgsPolygon,
+    QgsSpatialIndex,
+    QgsVectorDataProvider,
+    QgsWkbTypes,
 )
 from qgis import processing
 
@@ -49,9 +68,13 @@ class MorphBlocks(QgsProcessingAlgorithm):
     OUTPUT = "OUTPUT"
     EXTENT = "EXTENT"
     BUFFER_VALUE = "BUFFER_VALUE"
+    SIMPLIFY = "SIMPLIFY"
     OUTPUT_CENTROIDS = "OUTPUT_CENTROIDS"
     OUTPUT_BUFFER = "OUTPUT_BUFFER"
 
+    # Number of features handed over to a feature sink at once
+    BATCH_SIZE = 1024
+
     def name(self) -> str:
         """
         Returns the algorithm name, used for identifying the algorithm. This
@@ -125,6 +148,18 @@ class MorphBlocks(QgsProcessingAlgorithm):
                 "Buffer value in meters"
             )
         )
+
+        # Simplifying the blocks before buffering is faster, but may change
+        # the grouping of footprints close to a buffer boundary - so it is
+        # off by default
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SIMPLIFY,
+                "Simplify blocks before buffering (faster, may change the "
+                "block of footprints close to a buffer boundary)",
+                defaultValue=False,
+            )
+        )
         # We add a feature sink in which to store our processed features (this
         # usually takes the form of a newly created vector layer when the
         # algorithm is run in QGIS).
@@ -149,12 +184,16 @@ class MorphBlocks(QgsProcessingAlgorithm):
         self,
         parameters: dict[str, Any],
         context: QgsProcessingContext,
-        feedback: QgsProcessingFeedback,
+        model_feedback: QgsProcessingFeedback,
     ) -> dict[str, Any]:
         """
         Here is where the processing itself takes place.
         """
 
+        # Use a multi-step feedback, so that the progress of each step (and of
+        # the child algorithms) is reported relative to the whole algorithm
+        feedback = QgsProcessingMultiStepFeedback(8, model_feedback)
+
         # Retrieve the feature source and sink. The 'dest_id' variable is used
         # to uniquely identify the feature sink, and must be included in the
         # dictionary returned by the processAlgorithm function.
@@ -169,39 +208,89 @@ class MorphBlocks(QgsProcessingAlgorithm):
                 self.invalidSourceError(parameters, self.INPUT)
             )
 
-        # sink for each output
+        # final schema of the outputs: the blocks keep the attributes of the
+        # input and get the buffer id and the statistics of their inner holes.
+        # Like in the native algorithms, new fields whose name already exists
+        # in the input get a numeric suffix instead of clashing with it
+        block_statistics_fields = QgsFields()
+        block_statistics_fields.append(QgsField('buffer_fid', QVariant.Int))
+        block_statistics_fields.append(QgsField('holes_count', QVariant.Int))
+        block_statistics_fields.append(QgsField('holes_total_area', QVariant.Double))
+        block_fields = QgsProcessingUtils.combineFields(source.fields(), block_statistics_fields)
+
+        buffer_fields = QgsFields()
+        buffer_fields.append(QgsField('buffer_fid', QVariant.Int))
+
+        centroid_fields = QgsFields()
+        centroid_fields.append(QgsField('building_fid', QVariant.LongLong))
+        centroid_fields.append(QgsField('buffer_fid', QVariant.Int))
+
+        # blocks and buffers are multipolygons, the centroids points - all
+        # keep the Z and M dimensions of the input
+        polygon_type = QgsWkbTypes.multiType(source.wkbType())
+        point_type = QgsWkbTypes.Type.Point
+        if QgsWkbTypes.hasZ(source.wkbType()):
+            point_type = QgsWkbTypes.addZ(point_type)
+        if QgsWkbTypes.hasM(source.wkbType()):
+            point_type = QgsWkbTypes.addM(point_type)
+
+        # sink for each output - GeoPackage outputs are created without
+        # spatial index, which gets built after all features are written
+        layer_options = {
+            name: self.sinkLayerOptions(parameters, name, context)
+            for name in (self.OUTPUT, self.OUTPUT_BUFFER, self.OUTPUT_CENTROIDS)
+        }
+
         (sink, dest_id) = self.parameterAsSink(
             parameters,
             self.OUTPUT,
             context,
-            source.fields(),
-            source.wkbType(),
+            block_fields,
+            polygon_type,
+            source.sourceCrs(),
+            # several blocks can copy the attributes of the same footprint -
+            # including its primary key, e.g. the fid of a GeoPackage input
+            sinkFlags=QgsFeatureSink.SinkFlag.RegeneratePrimaryKey,
+            layerOptions=layer_options[self.OUTPUT],
+        )
+
+        (sink_buffer, buffer_id) = self.parameterAsSink(
+            parameters,
+            self.OUTPUT_BUFFER,
+            context,
+            buffer_fields,
+            polygon_type,
+            source.sourceCrs(),
+            layerOptions=layer_options[self.OUTPUT_BUFFER],
+        )
+
+        (sink_centroids, centroids_id) = self.parameterAsSink(
+            parameters,
+            self.OUTPUT_CENTROIDS,
+            context,
+            centroid_fields,
+            point_type,
             source.sourceCrs(),
-        )
-        
-        (sink_buffer, buffer_id) = self.parameterAsSink(
-            parameters,
-            self.OUTPUT_BUFFER,
-            context,
-            source.fields(),
-            source.wkbType(),
-            source.sourceCrs(),
-        )
-        
-        (sink_centroids, centroids_id) = self.parameterAsSink(
-            parameters,
-            self.OUTPUT_CENTROIDS,
-            context,
-            source.fields(),
-            source.wkbType(),
-            source.sourceCrs(),
+            layerOptions=layer_options[self.OUTPUT_CENTROIDS],
         )
 
+        self.deferred_spatial_indexes = [
+            layer_id
+            for name, layer_id in (
+                (self.OUTPUT, dest_id),
+                (self.OUTPUT_BUFFER, buffer_id),
+                (self.OUTPUT_CENTROIDS, centroids_id),
+            )
+            if layer_id and layer_options[name]
+        ]
+
         # Send some information to the user
         feedback.pushInfo(f"CRS is {source.sourceCrs().authid()}")
         
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(source)}")
+        # Print number of input features - counted once, as featureCount()
+        # can be expensive for some providers
+        feature_count = source.featureCount()
+        feedback.pushInfo(f"Number of features: {feature_count}")
 
         # If sink was not created, throw an exception to indicate that the algorithm
         # encountered a fatal error. The exception text can be any string, but in this
@@ -210,9 +299,17 @@ class MorphBlocks(QgsProcessingAlgorithm):
         
         if sink is None:
             raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        # nothing to group - the outputs are created, but stay empty
+        if feature_count == 0:
+            feedback.pushInfo("input layer is empty, skip processing")
+            return {self.OUTPUT: dest_id,
+                    self.OUTPUT_BUFFER: buffer_id,
+                    self.OUTPUT_CENTROIDS: centroids_id}
             
         buffer_value = self.parameterAsInt(parameters, self.BUFFER_VALUE, context)
-        spatial_extent = self.parameterAsExtent(parameters, self.EXTENT, context)
+        simplify = self.parameterAsBoolean(parameters, self.SIMPLIFY, context)
+        spatial_extent = self.parameterAsExtent(parameters, self.EXTENT, context, source.crs())
             
         # -------------------------------   
         # P R O C E S S I N G - S T E P S
@@ -222,341 +319,321 @@ class MorphBlocks(QgsProcessingAlgorithm):
             feedback.pushInfo("Script was canceled.")
             return
             
-        # -------------------------------   
-        # Execute "geometry repair" on input building dataset
-        # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("geometry repair")
-        repaired = processing.run("native:fixgeometries", {
-            'INPUT': source,
-            'METHOD':1,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        # because output of tool is a python dict, select key 'output' --> add ["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(repaired)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Clip input building layer to given spatial extent
-        # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("clip building footprints")
-        clipped = processing.run("native:extractbyextent", {
-            'INPUT':repaired,
-            'EXTENT':spatial_extent,
-            'CLIP':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(clipped)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Transform CRS to metric Web Mercator (EPSG: 3857) - only if required
+        # if the extent covers the whole layer, the clip (and the exact
+        # intersection test per feature) is skipped
+        clip = not spatial_extent.contains(source.extent())
+
         # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("project CRS")
-        
-        transformed = processing.run("native:reprojectlayer", {
-            'INPUT':clipped,
-            'TARGET_CRS':QgsCoordinateReferenceSystem('EPSG:3857'),
-            'CONVERT_CURVED_GEOMETRIES':False,
-            'OPERATION':'+proj=noop',
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(transformed)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Dissolve all building polygon footprints
+        # Create spatial index on input building dataset - only if required
         # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("dissolve all building footprints")
-        
-        dissolved_1 = processing.run("native:dissolve", {
-            'INPUT':transformed,
-            'FIELD':[],
-            'SEPARATE_DISJOINT':True,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(dissolved_1)}")
+        # the clip is the only step which reads the input through its
+        # spatial index - join and dissolve work on in-memory geometries
+        if clip and source.hasSpatialIndex() != QgsFeatureSource.SpatialIndexPresence.SpatialIndexPresent:
+            feedback.pushInfo("-----------------------------------------")
+            feedback.pushInfo("create spatial index")
+            if source.dataProvider().capabilities() & QgsVectorDataProvider.Capability.CreateSpatialIndex:
+                try:
+                    processing.run("native:createspatialindex", {
+                        'INPUT': source
+                    },
+                    context=context,
+                    feedback=feedback,
+                    is_child_algorithm=True,
+                    )
+                except QgsProcessingException as e:
+                    # e.g. a read-only input - the clip still works, only slower
+                    feedback.pushWarning(f"spatial index could not be created: {e}")
+            else:
+                feedback.pushInfo("data provider does not support spatial indexes, "
+                                  "consider saving the input as GeoPackage")
+
+            if feedback.isCanceled():
+                feedback.pushInfo("Script was canceled.")
+                return
+
+        feedback.setCurrentStep(1)
 
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Buffer with given buffer value NEGATIVE (inside)
         # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("starting buffer")
-        buffer_1 = processing.run("native:buffer", {
-            'INPUT':dissolved_1,
-            'DISTANCE':-buffer_value,
-            'SEGMENTS':5,
-            'END_CAP_STYLE':0,
-            'JOIN_STYLE':0,
-            'MITER_LIMIT':2,
-            'DISSOLVE':False,
-            'SEPARATE_DISJOINT':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(buffer_1)}")
-
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Buffer with given buffer value POSITIVE (outside)
+        # Clip input building layer to given spatial extent and execute
+        # "geometry repair" in a single pass over the features. Buffering and
+        # measuring happen in the CRS of the input, so the buffer value and
+        # the hole areas are in its units
         # -------------------------------
         feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("starting buffer")
-        buffer_2 = processing.run("native:buffer", {
-            'INPUT':buffer_1,
-            'DISTANCE':buffer_value,
-            'SEGMENTS':5,
-            'END_CAP_STYLE':0,
-            'JOIN_STYLE':0,
-            'MITER_LIMIT':2,
-            'DISSOLVE':False,
-            'SEPARATE_DISJOINT':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
+        feedback.pushInfo("clip building footprints and geometry repair")
+
+        # the extent is passed to the data provider as filter, which uses
+        # the spatial index of the input instead of copying the layer.
+        # Attributes are not read here, only the first footprint of each
+        # block needs them (see dissolve step)
+        request = QgsFeatureRequest().setNoAttributes()
+        if not clip:
+            feedback.pushInfo("extent covers the whole input layer, skip clip")
+        else:
+            request.setFilterRect(spatial_extent)
+            request.setFlags(QgsFeatureRequest.Flag.ExactIntersect)
+
+        # the repaired footprints are only needed within this algorithm, so
+        # they are kept as a list of features instead of a memory layer,
+        # which would copy every feature again on each read
+        repaired = []
+
+        # the repair is independent for every feature and GEOS releases
+        # the GIL, so batches of features are processed in parallel. Only a
+        # limited number of batches is in flight, so the input is read at the
+        # pace of the repair instead of all at once - the results are
+        # collected in this thread in the order of the input
+        max_pending = 2 * (os.cpu_count() or 1)
+        batches = self.batched(source.getFeatures(request), self.BATCH_SIZE)
+        pending = deque()
+        processed = 0
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            while not feedback.isCanceled():
+                batch = next(batches, None)
+                if batch is not None:
+                    pending.append((executor.submit(self.repairGeometries, batch), len(batch)))
+                    if len(pending) < max_pending:
+                        continue
+                if not pending:
+                    break
+                future, batch_size = pending.popleft()
+                repaired_features, errors = future.result()
+                for error in errors:
+                    feedback.reportError(error)
+                repaired.extend(repaired_features)
+                processed += batch_size
+                if feature_count > 0:
+                    feedback.setProgress(min(processed * 100 // feature_count, 100))
+            for future, _ in pending:
+                future.cancel()
+
         # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(buffer_2)}")
+        feedback.pushInfo(f"Number of features: {len(repaired)}")
         
         if feedback.isCanceled():
             feedback.pushInfo("Script was canceled.")
             return
-            
-        # -------------------------------   
-        # Create centroid (on surface) for each origin building footprint - including building id
-        # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("create centroid")
-        
-        centroids = processing.run("native:pointonsurface", {
-            'INPUT':transformed,
-            'ALL_PARTS':False,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(centroids)}")
 
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Join buffer id to centroid 
+        feedback.setCurrentStep(2)
+
         # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("join buffer id to centroid")
-        
-        centroid_with_buffer_id = processing.run("native:joinattributesbylocation", {
-            'INPUT':centroids,
-            'PREDICATE':[0,1,2,3,4,5,6],
-            'JOIN':buffer_2,
-            'JOIN_FIELDS':['fid'],
-            'METHOD':0,
-            'DISCARD_NONMATCHING':False,
-            'PREFIX':'buffer_',
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(centroid_with_buffer_id)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Join buffer id to origin building footprint - using centroid
+        # Dissolve all building polygon footprints and apply morphological
+        # closing: buffer with given buffer value NEGATIVE (inside) and
+        # POSITIVE (outside) in one go
         # -------------------------------
         feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("join buffer id to origin building footprint")
-        
-        transformed_with_buffer_id = processing.run("native:joinattributestable", {
-            'INPUT':transformed,
-            'FIELD':'fid',
-            'INPUT_2':centroid_with_buffer_id,
-            'FIELD_2':'fid',
-            'FIELDS_TO_COPY':['buffer_fid'],
-            'METHOD':1,
-            'DISCARD_NONMATCHING':False,
-            'PREFIX':'',
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
+        feedback.pushInfo("dissolve all building footprints and starting buffer")
+
+        # union and both buffers are computed on in-memory geometries, so
+        # neither the dissolved nor the shrunk intermediate result gets
+        # written to a layer
+        dissolved_1 = QgsGeometry.unaryUnion([
+            feature.geometry()
+            for feature in repaired
+        ])
+
+        buffer_features = []
+        # like native:dissolve with SEPARATE_DISJOINT, each disjoint part of
+        # the union is buffered on its own and becomes a separate buffer. The
+        # parts are independent tiles of the input without shared borders, so
+        # they are buffered in parallel - the buffer features are only
+        # created in this thread, which keeps their ids in order
+        parts = dissolved_1.asGeometryCollection()
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(
+                partial(self.closeBlock, buffer_value=buffer_value, simplify=simplify),
+                parts,
+            )
+            for i, geometry in enumerate(results):
+                # the buffers of large blocks take a while, so check in between
+                if feedback.isCanceled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    feedback.pushInfo("Script was canceled.")
+                    return
+                feedback.setProgress(i * 100 // len(parts))
+                if geometry.isNull():
+                    feedback.reportError(f"buffer failed: {geometry.lastError()}")
+                    continue
+                if geometry.isEmpty():
+                    # building block vanished completely in negative buffer
+                    continue
+                geometry.convertToMultiType()
+                feature = QgsFeature(buffer_fields, len(buffer_features))
+                feature.setGeometry(geometry)
+                feature.setAttributes([feature.id()])
+                buffer_features.append(feature)
+
+        # the union of all footprints can be as large as the input itself,
+        # release it before the next steps build their own structures
+        del dissolved_1, parts
+
         # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(transformed_with_buffer_id)}")
+        feedback.pushInfo(f"Number of features: {len(buffer_features)}")
 
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
+        if feedback.isCanceled():
+            feedback.pushInfo("Script was canceled.")
             return
-            
-        # -------------------------------   
-        # Dissolve origin building footprint by buffer id
+
+        feedback.setCurrentStep(3)
+
         # -------------------------------
-        feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("dissolve origin building footprint by buffer id")
-        
-        dissolved_2 = processing.run("native:dissolve", {
-            'INPUT':transformed_with_buffer_id,
-            'FIELD':['buffer_fid'],
-            'SEPARATE_DISJOINT':True,
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(dissolved_2)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
-            return
-            
-        # -------------------------------   
-        # Add column "holes_count" with number of inner holes
+        # Create centroid (on surface) for each origin building footprint -
+        # including building id - and join buffer id to centroid
         # -------------------------------
         feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("add column holes_count")
-        
-        dissolved_3 = processing.run("native:addfieldtoattributestable", {
-            'INPUT':dissolved_2, 
-            'FIELD_NAME':'holes_count',
-            'FIELD_TYPE':0,
-            'FIELD_LENGTH':10,
-            'FIELD_PRECISION':0,
-            'FIELD_ALIAS':'',
-            'FIELD_COMMENT':'',
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
-        # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(dissolved_3)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
+        feedback.pushInfo("create centroid and join buffer id to centroid")
+
+        # build the spatial index over the buffer polygons once, so each
+        # centroid only gets tested against the buffers around it - the
+        # buffer features keep their buffer_fid as feature id here
+        buffer_index = QgsSpatialIndex()
+        buffer_index.addFeatures(buffer_features)
+        buffer_geometries = {feature.id(): feature.geometry() for feature in buffer_features}
+
+        # every buffer polygon gets tested against many centroids, so prepare
+        # them once - the engines refer to the geometries kept in the dict
+        buffer_engines = {}
+        for buffer_fid, geometry in buffer_geometries.items():
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            buffer_engines[buffer_fid] = engine
+
+        # the centroids are computed straight from the footprint geometries,
+        # building_fid is the feature id of the footprint in the input layer.
+        # The footprints are grouped by buffer id in the same pass - like
+        # native:dissolve, the attributes of the first feature of a group are
+        # kept for the block. The centroid features are only built, if the
+        # optional centroid output is requested
+        groups = {}
+        centroid_features = []
+        create_centroids = sink_centroids is not None
+        for building in repaired:
+            point = building.geometry().pointOnSurface()
+            buffer_fid = None
+            for candidate_id in buffer_index.intersects(point.boundingBox()):
+                if buffer_engines[candidate_id].contains(point.constGet()):
+                    buffer_fid = candidate_id
+                    break
+            if buffer_fid not in groups:
+                groups[buffer_fid] = (building, [])
+            groups[buffer_fid][1].append(building.geometry())
+
+            if create_centroids:
+                centroid = QgsFeature(centroid_fields)
+                centroid.setGeometry(point)
+                centroid.setAttributes([building.id(), buffer_fid])
+                centroid_features.append(centroid)
+
+        if buffer_value == 0:
+            # without closing, each buffer is the union of the footprints in
+            # it already, so the group does not need to be unioned again
+            for buffer_fid, (first_feature, geometries) in groups.items():
+                if buffer_fid is not None:
+                    groups[buffer_fid] = (first_feature, [buffer_geometries[buffer_fid]])
+
+        # the groups hold all footprint geometries needed from here on, so
+        # the repaired features and the join structures are released - the
+        # engines refer to the buffer geometries and go first
+        del repaired, buffer_index, buffer_engines, buffer_geometries
+
+        # Print number of buffers the footprints were joined to
+        feedback.pushInfo(f"Number of buffer groups: {len(groups)}")
+
+        if feedback.isCanceled():
+            feedback.pushInfo("Script was canceled.")
             return
-            
-        # -------------------------------   
-        # Add column "holes_total_area" with total area of inner holes
+
+        feedback.setCurrentStep(4)
+
+        # -------------------------------
+        # Dissolve origin building footprint by buffer id and compute
+        # "holes_count" with number of inner holes and "holes_total_area"
+        # with total area of inner holes
         # -------------------------------
         feedback.pushInfo("-----------------------------------------")
-        feedback.pushInfo("add column holes_total_area")
-        dissolved_4 = processing.run("native:addfieldtoattributestable", {
-            'INPUT':dissolved_3, 
-            'FIELD_NAME':'holes_count',
-            'FIELD_TYPE':0,
-            'FIELD_LENGTH':10,
-            'FIELD_PRECISION':0,
-            'FIELD_ALIAS':'',
-            'FIELD_COMMENT':'',
-            'OUTPUT':'TEMPORARY_OUTPUT'
-        },
-        context=context,
-        feedback=feedback,
-        )["OUTPUT"]
-        
+        feedback.pushInfo("dissolve origin building footprint by buffer id")
+
+        # only the first footprint of each group passes its attributes on to
+        # the block, so only those attributes are fetched from the input
+        attribute_request = QgsFeatureRequest().setFilterFids(
+            [first_feature.id() for first_feature, _ in groups.values()]
+        )
+        attribute_request.setFlags(QgsFeatureRequest.Flag.NoGeometry)
+        attributes = {
+            feature.id(): feature.attributes()
+            for feature in source.getFeatures(attribute_request)
+        }
+        # feature ids are not stable between iterations for every provider
+        # (e.g. database views without a key), so a footprint may not be
+        # found again - its block is written with empty input attributes
+        empty_attributes = [None] * source.fields().count()
+        missing_count = 0
+        for buffer_fid, (first_feature, geometries) in groups.items():
+            group_attributes = attributes.get(first_feature.id())
+            if group_attributes is None:
+                missing_count += 1
+                group_attributes = empty_attributes
+            groups[buffer_fid] = (group_attributes, geometries)
+        if missing_count > 0:
+            feedback.pushWarning(
+                f"attributes of {missing_count} footprints could not be read "
+                "again from the input, their blocks keep empty attributes"
+            )
+
+        # the groups do not share any geometry, so their unions run in
+        # parallel like the geometry repair - the results are only collected
+        # in this thread
+        dissolved_features = []
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(
+                partial(self.dissolveGroup, fields=block_fields),
+                groups.items(),
+            )
+            for i, block_features in enumerate(results):
+                if feedback.isCanceled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    feedback.pushInfo("Script was canceled.")
+                    return
+                feedback.setProgress(i * 100 // len(groups))
+                dissolved_features.extend(block_features)
+
         # Print number of input features
-        feedback.pushInfo(f"Number of features: {len(dissolved_4)}")
-        
-        if feedback.isCanceled():
-            feedback.pushInfo("Script was canceled.")
+        feedback.pushInfo(f"Number of features: {len(dissolved_features)}")
+
+        if feedback.isCanceled():
+            feedback.pushInfo("Script was canceled.")
             return
-            
+
+        feedback.setCurrentStep(5)
+
         # -------------------------------
-        # load result into output Feature Sink
+        # load result into output Feature Sink - the features are handed over
+        # straight from the lists, without copying them into memory layers
         # -------------------------------
-        
-        features_output = dissolved_4.getFeatures()
+        self.addFeaturesInBatches(sink, dissolved_features, feedback)
 
-        for current, feature in enumerate(features_output):
-            # Add a feature in the sink
-            sink.addFeature(feature, QgsFeatureSink.Flag.FastInsert)
+        feedback.pushInfo(f"Number of processed blocks: {len(dissolved_features)}")
 
-        feedback.pushInfo(f"Number of processed blocks: {len(dissolved_4)}")
+        feedback.setCurrentStep(6)
 
         # -------------------------------
         # load result into output BUFFER Feature Sink
         # -------------------------------
-        
-        features_output_buffer = buffer_2.getFeatures()
+        if sink_buffer is not None:
+            self.addFeaturesInBatches(sink_buffer, buffer_features, feedback)
 
-        for current, feature in enumerate(features_output_buffer):
-            # Add a feature in the sink
-            sink_buffer.addFeature(feature, QgsFeatureSink.Flag.FastInsert)
+            feedback.pushInfo(f"Number of processed buffers: {len(buffer_features)}")
+
+        feedback.setCurrentStep(7)
 
-        feedback.pushInfo(f"Number of processed buffers: {len(dissolved_4)}")        
-        
         # -------------------------------
         # load result into output CENTROIDS Feature Sink
         # -------------------------------
-        
-        features_output_centroids = centroid_with_buffer_id.getFeatures()
+        if sink_centroids is not None:
+            self.addFeaturesInBatches(sink_centroids, centroid_features, feedback)
 
-        for current, feature in enumerate(features_output_centroids):
-            # Add a feature in the sink
-            sink_centroids.addFeature(feature, QgsFeatureSink.Flag.FastInsert)
+            feedback.pushInfo(f"Number of processed centroids: {len(centroid_features)}")
 
-        feedback.pushInfo(f"Number of processed centroids: {len(centroid_with_buffer_id)}")        
-        
-        
         # Return the results of the algorithm. In this case our only result is
         # the feature sink which contains the processed features, but some
         # algorithms may return multiple feature sinks, calculated numeric
@@ -569,5 +646,197 @@ class MorphBlocks(QgsProcessingAlgorithm):
                 self.OUTPUT_BUFFER: buffer_id, 
                 self.OUTPUT_CENTROIDS: centroids_id}
 
+    def addFeaturesInBatches(
+        self,
+        sink: QgsFeatureSink,
+        features: list[QgsFeature],
+        feedback: QgsProcessingFeedback,
+    ):
+        """
+        Writes the features into the sink. Features are handed over in
+        batches of BATCH_SIZE, which saves a call into the data provider per
+        feature and updates the progress bar once per batch.
+        """
+        feature_count = len(features)
+        written = 0
+
+        for batch in self.batched(features, self.BATCH_SIZE):
+            if feedback.isCanceled():
+                return
+            sink.addFeatures(batch, QgsFeatureSink.Flag.FastInsert)
+            written += len(batch)
+            if feature_count > 0:
+                feedback.setProgress(written * 100 // feature_count)
+
+    @staticmethod
+    def batched(iterable: Iterable, size: int) -> Iterator[list]:
+        """
+        Splits an iterable into lists of at most size items.
+        """
+        iterator = iter(iterable)
+        while batch := list(islice(iterator, size)):
+            yield batch
+
+    @staticmethod
+    def repairGeometries(
+        features: list[QgsFeature],
+    ) -> tuple[list[QgsFeature], list[str]]:
+        """
+        Repairs the invalid geometries of the features - same as
+        native:fixgeometries with METHOD 1 (structure). Returns the repaired
+        features and the error messages of features whose geometry could not
+        be repaired. Safe to run in worker threads, as it does not report to
+        the feedback object.
+        """
+        repaired_features = []
+        errors = []
+
+        for feature in features:
+            # features without geometry cannot be part of a block, they are
+            # skipped without being reported as failed repairs
+            if not feature.hasGeometry():
+                continue
+            geometry = feature.geometry()
+            # most footprints are valid - the validity check is much cheaper
+            # than rebuilding every geometry with makeValid
+            if not geometry.isGeosValid():
+                geometry = geometry.makeValid(Qgis.MakeValidMethod.Structure)
+                if geometry.isNull():
+                    errors.append(f"geometry repair failed for feature {feature.id()}: {geometry.lastError()}")
+                    continue
+                geometry.convertGeometryCollectionToSubclass(QgsWkbTypes.GeometryType.PolygonGeometry)
+            geometry.convertToMultiType()
+            feature.setGeometry(geometry)
+            repaired_features.append(feature)
+
+        return repaired_features, errors
+
+    @staticmethod
+    def closeBlock(part: QgsGeometry, buffer_value: int, simplify: bool) -> QgsGeometry:
+        """
+        Buffers one disjoint part of the footprint union with the negative
+        and then the positive buffer value, optionally simplifying it first.
+        Returns a null geometry, if a buffer failed. Safe to run in worker
+        threads.
+        """
+        if buffer_value == 0:
+            # buffering by 0 in both directions leaves the part unchanged
+            return QgsGeometry(part)
+
+        # the buffers scale with the number of vertices, so on request the
+        # part is simplified first. Douglas-Peucker keeps the outline within the
+        # tolerance, so the buffers move by about buffer_value / 20 at most,
+        # except at connections whose width is that close to twice the buffer
+        # value - there the closing may separate or merge differently. As the
+        # buffers decide which footprints are grouped, the membership of
+        # blocks (and so the block geometries and hole statistics) can change
+        # for footprints within that distance of a buffer boundary, which are
+        # borderline cases for the chosen buffer value anyway
+        if simplify and buffer_value > 0:
+            simplified = part.simplify(buffer_value / 20)
+            if not simplified.isNull() and not simplified.isEmpty():
+                part = simplified
+
+        # the shrunk geometry is only an intermediate, so it is built with
+        # mitred joins. The buffers only decide which footprints form a block
+        # (the blocks are unions of the footprints), so both get by with few
+        # segments - the positive buffer keeps round joins to not grow beyond
+        # the closing at sharp corners
+        geometry = part.buffer(
+            -buffer_value, 2, Qgis.EndCapStyle.Round, Qgis.JoinStyle.Miter, 2.0
+        )
+        if not geometry.isNull():
+            geometry = geometry.buffer(buffer_value, 2)
+        return geometry
+
+    @staticmethod
+    def dissolveGroup(
+        group: tuple[Optional[int], tuple[list[Any], list[QgsGeometry]]],
+        fields: QgsFields,
+    ) -> list[QgsFeature]:
+        """
+        Unions the footprint geometries of one buffer group. Like
+        native:dissolve, disjoint parts become separate features which keep
+        the given attributes of the first feature of the group. The block
+        features are created with their final schema, so the buffer id and
+        the hole statistics are set right here instead of adding columns
+        afterwards. Safe to run in worker threads.
+        """
+        buffer_fid, (attributes, geometries) = group
+        block_features = []
+
+        # a single valid geometry has nothing to merge, the union would only
+        # return it again - so GEOS is skipped for buildings standing alone
+        if len(geometries) == 1:
+            union = geometries[0]
+        else:
+            union = QgsGeometry.unaryUnion(geometries)
+        for part in union.asGeometryCollection():
+            part.convertToMultiType()
+            holes_count, holes_total_area = MorphBlocks.holesStatistics(part)
+            feature = QgsFeature(fields)
+            feature.setGeometry(part)
+            feature.setAttributes(
+                attributes + [buffer_fid, holes_count, holes_total_area]
+            )
+            block_features.append(feature)
+
+        return block_features
+
+    @staticmethod
+    def holesStatistics(geometry: QgsGeometry) -> tuple[int, float]:
+        """
+        Returns the number of inner holes (interior rings) of a (multi)polygon
+        geometry and their total area.
+        """
+        holes_count = 0
+        holes_total_area = 0.0
+
+        for part in geometry.constParts():
+            for i in range(part.numInteriorRings()):
+                hole = QgsPolygon()
+                hole.setExteriorRing(part.interiorRing(i).clone())
+                holes_count += 1
+                holes_total_area += hole.area()
+
+        return holes_count, holes_total_area
+
+    def sinkLayerOptions(
+        self,
+        parameters: dict[str, Any],
+        name: str,
+        context: QgsProcessingContext,
+    ) -> list[str]:
+        """
+        Returns the layer creation options for the given output. GeoPackage
+        layers maintain their RTree index with triggers on every insert, which
+        is much slower than building the index once after the bulk load. So
+        the index is disabled here and created in postProcessAlgorithm.
+        """
+        destination = self.parameterAsOutputLayer(parameters, name, context)
+        if not destination or ".gpkg" not in destination.lower():
+            return []
+        return ["SPATIAL_INDEX=NO"]
+
+    def postProcessAlgorithm(
+        self,
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+    ) -> dict[str, Any]:
+        """
+        Creates the spatial indexes of GeoPackage outputs, after the feature
+        sinks have been flushed and closed.
+        """
+        for layer_id in getattr(self, "deferred_spatial_indexes", []):
+            feedback.pushInfo(f"create spatial index for {layer_id}")
+            processing.run("native:createspatialindex", {
+                'INPUT': layer_id
+            },
+            context=context,
+            feedback=feedback,
+            is_child_algorithm=True,
+            )
+        return {}
+
     def createInstance(self):
         return self.__class__()